@@ -5,4 +5,6 @@
 from peps import *
 
 # required for delayExec executions
-from policy.replication import replicate, sync_replicas
+from policy.checksum import async_ensure_replicas_checksum, checksum_replica
+from policy.replication import (
+    replicate, replicate_many, sync_replicas, sync_replicas_many)
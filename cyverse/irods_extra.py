@@ -3,6 +3,16 @@
 """Support functions and constants for the iRODS Python Rule Engine."""
 
 import json
+import threading
+
+import genquery  # type: ignore
+
+# ujson is a good deal faster than the standard json module, so prefer it for
+# the rule argument payloads when it's installed.
+try:
+    import ujson as _fast_json  # type: ignore
+except ImportError:
+    _fast_json = None
 
 
 """indicates that a file was created"""
@@ -67,22 +77,123 @@ the replica need not exist, but if it does, it will be truncated
 OPEN_FLAG_WP_CREATE = '578'
 
 
+# the POSIX open flag bits that matter when deciding if a replica may have
+# been modified
+_O_ACCMODE = 0o3
+_O_RDONLY = 0o0
+_O_CREAT = 0o100
+_O_TRUNC = 0o1000
+
+
+def opened_read_only(open_flags):
+    """Determine if a data object was opened for reading only.
+
+    Parameters:
+        open_flags  the open flag set as an int
+    """
+    return open_flags & (_O_ACCMODE | _O_CREAT | _O_TRUNC) == _O_RDONLY
+
+
 def replica_truncated(open_flags):
     """Determine if a data object was truncted on open.
 
     Parameters:
-        open_flags  the open flag set
+        open_flags  the open flag set as an int
+    """
+    return bool(open_flags & _O_TRUNC)
+
+
+# NOTE: Ideally, the write properties would be a map from data objects to
+# property sets, since multiple data objects can be uploaded concurrently using
+# data_obj_create/data_obj_open + data_obj_write + data_obj_close or
+# replica_open + data_obj_write + data_obj_close. Unfortunately, for the
+# data_obj_write doesn't know the data object's Id or path, and data_obj_open
+# doesn't know the data objects l1descInx, so there's know way to be sure that
+# data object handled by a given data_obj_open call is the same as that being
+# handled by a subsequent data_obj_write call.
+#
+# Each agent serves a single client connection, so the properties only need to
+# be kept per thread. That way, rules running concurrently in the same process
+# can't see each other's properties.
+__write_state = threading.local()
+
+
+def write_props(owner):
+    """Retrieve the write properties a rule base has set in this thread.
+
+    Each rule base passes its own module name as owner, so that the rule bases
+    don't see each other's properties. The properties are a dict that the rule
+    base may modify.
+    """
+    return __write_state.__dict__.setdefault(owner, {})
+
+
+def reset_write_props(owner):
+    """Forget the write properties a rule base has set in this thread."""
+    __write_state.__dict__.pop(owner, None)
+
+
+def record_create(owner, data_obj_inp):
+    """Record a data object creation in a rule base's write properties.
+
+    The following entries are set.
+
+    'data_path'  the absolute path to the data object
+    'resc_hier'  the resource hierarchy holding the new replica
+    'created'    True
+    'modified'   False
     """
-    return open_flags in [
-        OPEN_FLAG_W, OPEN_FLAG_W_CREATE, OPEN_FLAG_WP, OPEN_FLAG_WP_CREATE]
+    props = write_props(owner)
+    opts = to_dict(data_obj_inp.condInput)
+    props['data_path'] = str(data_obj_inp.objPath)
+    props['resc_hier'] = value(opts, 'resc_hier')
+    props['created'] = True
+    props['modified'] = False
+
+
+def record_open(owner, data_obj_inp):
+    """Record a data object open in a rule base's write properties.
+
+    The entries are the same as those set by record_create, except 'created'
+    tells whether or not the open created the data object and 'modified' tells
+    whether or not it truncated the replica. A PEP handling a write should set
+    'modified' to True.
+    """
+    props = write_props(owner)
+    flags = int(data_obj_inp.openFlags)
+    opts = to_dict(data_obj_inp.condInput)
+    props['data_path'] = str(data_obj_inp.objPath)
+    props['resc_hier'] = value(opts, 'resc_hier')
+
+    if opened_read_only(flags):
+        props['created'] = False
+        props['modified'] = False
+    else:
+        props['created'] = value(opts, 'openType') == FILE_CREATE
+        props['modified'] = replica_truncated(flags)
 
 
 """indicates that a rule succeeded"""
 SUCCESS = 0
 
 
+def to_dict(kv_map):
+    """Copy the entries of the given KeyValPair into a dict.
+
+    Each probe of a KeyValPair crosses into the rule engine, so when a PEP
+    needs to look at several of its entries, it should convert it once and
+    probe the dict instead. The dict can be passed to has_key and value.
+    """
+    keys = kv_map.key
+    values = kv_map.value
+    return {str(keys[i]): str(values[i]) for i in range(kv_map.len)}
+
+
 def has_key(kv_map, key):
     """Test to see if the given KeyValMap contains the given key."""
+    if isinstance(kv_map, dict):
+        return key in kv_map
+
     try:
         kv_map[key]
         return True
@@ -95,26 +206,180 @@ def value(kv_map, key):
 
     If the key isn't found, it returns the empty string
     """
+    if isinstance(kv_map, dict):
+        return str(kv_map.get(key, ""))
+
     try:
         return str(kv_map[key])
     except KeyError:
         return ""
 
 
+def to_json(obj):
+    """Serialize the given object as compact JSON."""
+    if _fast_json:
+        return _fast_json.dumps(obj)
+
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def from_json(doc):
+    """Deserialize the given JSON document."""
+    return _fast_json.loads(doc) if _fast_json else json.loads(doc)
+
+
+"""the delayExec condition template for running a Python rule once"""
+_DELAY_COND = (
+    "<INST_NAME>irods_rule_engine_plugin-python-instance</INST_NAME>"
+    "<PLUSET>%ds</PLUSET><EF>0s REPEAT 0 TIMES</EF>")
+
+
+def delay_cond(delay):
+    """Build the delayExec condition for running a Python rule once.
+
+    Parameters:
+        delay  the number of seconds to wait before running the rule
+    """
+    return _DELAY_COND % delay
+
+
+def task_text(rule_name, *args):
+    """Build the Python rule text that calls the named rule with the arguments.
+
+    The text is meant to be passed to delayExec. Each argument is converted to
+    a string and inserted with repr(), so that it becomes a properly quoted
+    Python string literal whatever it contains.
+    """
+    return "callback.%s(%s)" % (
+        rule_name, ', '.join(repr(str(arg)) for arg in args))
+
+
+"""the touch options that select an existing replica"""
+_TOUCH_REPLICA_OPTS = frozenset(('replica_number', 'leaf_resource_name'))
+
+
+def touch_may_create(touch_inp):
+    """Determine if a touch may have created its data object.
+
+    Parameters:
+        touch_inp  the touch API's JSON input, already deserialized
+    """
+    opts = touch_inp.get('options', {})
+    return not opts.get('no_create') and _TOUCH_REPLICA_OPTS.isdisjoint(opts)
+
+
+# GenQuery conditions selecting data objects. The values are filled in with
+# the % operator, so each condition keeps the same shape from call to call.
+DATA_COND = "COLL_NAME = '%s' and DATA_NAME = '%s'"
+DATA_NAMES_COND = "COLL_NAME = '%s' and DATA_NAME in (%s)"
+
+
 def split_path(data_path):
     """Split a data object path into parent collection path and data name.
 
     Given the absolute path to a data object, it returns a tuple containing the
     absolute path to the object's collection and the object's name.
     """
-    return tuple(data_path.rsplit('/', 1))
+    coll_path, _, data_name = data_path.rpartition('/')
+    return coll_path, data_name
+
+
+def unique(values):
+    """Return the distinct values of a sequence in their original order."""
+    seen = set()
+    result = []
+
+    for v in values:
+        if v not in seen:
+            seen.add(v)
+            result.append(v)
+
+    return result
+
+
+def group_by_coll(data_paths):
+    """Group data object paths by the collections holding them.
+
+    It returns a dict mapping each collection path to the list of names of
+    the data objects in the collection. The order of the names is preserved.
+    """
+    groups = {}
+
+    for data_path in data_paths:
+        coll_path, data_name = split_path(data_path)
+        groups.setdefault(coll_path, []).append(data_name)
+
+    return groups
+
+
+"""the longest value list that will be put in a single GenQuery IN condition"""
+_MAX_IN_LIST_LEN = 1000
+
+
+def in_lists(values):
+    """Break a sequence of values up into GenQuery IN condition value lists.
+
+    Each generated list has the form "'v1', 'v2', ..." and is kept short
+    enough to be accepted in a GenQuery condition.
+    """
+    batch = []
+    batch_len = 0
+
+    for v in values:
+        literal = "'{}'".format(v)
+
+        if batch and batch_len + len(literal) > _MAX_IN_LIST_LEN:
+            yield ', '.join(batch)
+            batch = []
+            batch_len = 0
+
+        batch.append(literal)
+        batch_len += len(literal) + 2
+
+    if batch:
+        yield ', '.join(batch)
+
+
+def query_data_objs(ctx, cols, data_paths, cond=''):
+    """Query the replicas of a set of data objects.
+
+    The replicas are looked up for a whole collection's worth of data objects
+    at once instead of querying for each data object. For each replica found,
+    it yields the data object's path and the list of the values of the given
+    columns. If cond is given, it further restricts the replicas.
+    """
+    for coll_path, data_names in group_by_coll(data_paths).items():
+        for names in in_lists(data_names):
+            full_cond = DATA_NAMES_COND % (coll_path, names)
+
+            if cond:
+                full_cond += ' and ' + cond
+
+            recs = list(genquery.Query(
+                ctx.callback, ('DATA_NAME',) + tuple(cols), full_cond))
+
+            for rec in recs:
+                yield "{}/{}".format(coll_path, rec[0]), rec[1:]
+
+
+__default_resc = None
 
 
 def default_resc():
-    """Return the default_resource_name from server_config.json."""
-    with open('/etc/irods/server_config.json') as f:
-        server_config = json.load(f)
-        return server_config['default_resource_name']
+    """Return the default_resource_name from server_config.json.
+
+    The configuration file is only read the first time this is called. Since
+    each agent serves a single connection, a changed default resource is
+    picked up by the next agent.
+    """
+    global __default_resc
+
+    if __default_resc is None:
+        with open('/etc/irods/server_config.json') as f:
+            server_config = json.load(f)
+            __default_resc = server_config['default_resource_name']
+
+    return __default_resc
 
 
 def root_resc(resc_hier):
@@ -3,7 +3,6 @@
 """CyVerse-wide data policy."""
 
 import irods_errors  # type: ignore
-import json
 
 import irods_extra
 import throttle
@@ -15,27 +14,51 @@ from yoda import rule
 _RE_DONE = 0
 
 
+def _resolve_rules(rule_bases, pep_name):
+    """Return the rules the given bases bind to the named PEP.
+
+    A rule base that doesn't bind a rule to the PEP is skipped.
+    """
+    return tuple(
+        getattr(base, pep_name) for base in rule_bases
+        if hasattr(base, pep_name))
+
+
 def _compose(
     rule_bases,
     success_resp=irods_errors.RULE_ENGINE_CONTINUE,
     fail_resp=_RE_DONE,
     cont_on_fail=False
 ):
+    # A falsy fail_resp means the failing rule's code is returned.
+    fail_code = fail_resp if fail_resp else None
+
     def decorate(pep):
-        def impl(*args):
-            resp = success_resp
+        handlers = _resolve_rules(rule_bases, pep.__name__)
+
+        # bound here so impl reads it from its closure instead of a global
+        success = irods_extra.SUCCESS
 
-            for base in rule_bases:
-                res = getattr(base, pep.__name__)(*args)
+        def impl(rule_args, callback, rei):
+            first_fail = 0
 
-                if res < irods_extra.SUCCESS:
-                    if resp == success_resp:
-                        resp = fail_resp if fail_resp else res
+            for handler in handlers:
+                # A rule.make wrapper may overwrite the rule arguments with its
+                # return values, so each handler gets its own copy of them.
+                res = handler(list(rule_args), callback, rei)
+
+                # rule.make wrappers return None, which Python 2 orders below
+                # every int, so it has to be treated as success explicitly.
+                if res is not None and res < success:
+                    first_fail = first_fail or res
 
                     if not cont_on_fail:
                         break
 
-            return resp
+            if not first_fail:
+                return success_resp
+
+            return first_fail if fail_code is None else fail_code
         return impl
     return decorate
 
@@ -125,6 +148,21 @@ def pep_api_replica_close_finally(): pass
 def async_api_bulk_data_obj_put_post(): pass
 
 
+# The PluginContext fields passed along to the async_api_bulk_data_obj_put_post
+# rules. None of them currently read it, so nothing is passed.
+_BULK_PUT_COMM_FIELDS = ()
+
+
+def _comm_projection(comm, fields):
+    # comm.map() walks every PluginContext field, so skip it when none of them
+    # are wanted.
+    if not fields:
+        return "{}"
+
+    comm_map = comm.map()
+    return irods_extra.to_json({f: comm_map[f] for f in fields})
+
+
 # NOTE: https://github.com/irods/irods/issues/7110  bulk_data_obj_put is broken
 #       when the forceFlag is set. It's scheduled to be fixed in iRODS 4.3.1.
 @rule.make(inputs=[0,1,2,3])
@@ -171,19 +209,20 @@ def pep_api_bulk_data_obj_put_post(
     }
 
     GenQueryOut => {
-        rowCnt:         int,
-        attriCnt:       int,
-        continueInx:    int,
-        totalRowCount:  int,
-        sqlResult:      [ {} ]  # array of SqlResult
+        sqlResult:  [ {} ]  # array of SqlResult
     }
 
     SqlResult => {
-        attriInx:  int,
-        len:       int,
-        row:       [ str ]
+        row:  [ str ]
     }
 
+    Only the PluginContext fields listed in _BULK_PUT_COMM_FIELDS are
+    included.
+
+    Only the first SqlResult, the one holding the logical paths of the
+    uploaded data objects, is included. None of the rules need the other
+    attributes, so they aren't serialized.
+
     KeyValPair => { str:  str, ... }
 
     PluginContext => {
@@ -224,46 +263,29 @@ def pep_api_bulk_data_obj_put_post(
         'user_user_type':                       str
     }
     """
+    # Every attribute access on a foreign object crosses into the rule engine,
+    # so look each one up only once.
     attris = bulk_opr_inp.attriArray
+    row = attris.sqlResult[0].row
 
     boi_map = {
         'objPath': str(bulk_opr_inp.objPath),
         'attriArray': {
-            'rowCnt': attris.rowCnt,
-            'attriCnt': attris.attriCnt,
-            'continueInx': attris.continueInx,
-            'totalRowCount': attris.totalRowCount,
-            'sqlResult': [],
+            'sqlResult': [{'row': [row(r) for r in range(attris.rowCnt)]}]
         },
-        'condInput': {}
+        'condInput': irods_extra.to_dict(bulk_opr_inp.condInput)
     }
 
-    for a in range(attris.attriCnt):
-        boi_map['attriArray']['sqlResult'].append({
-            'attriInx': attris.sqlResult[a].attriInx,
-            'len': attris.sqlResult[a].len,
-            'row': [attris.sqlResult[a].row(r) for r in range(attris.rowCnt)]})
-
-    for i in range(bulk_opr_inp.condInput.len):
-        boi_map['condInput'][str(bulk_opr_inp.condInput.key[i])] = (
-            str(bulk_opr_inp.condInput.value[i]))
-
-    cond_fmt = (
-        "<INST_NAME>irods_rule_engine_plugin-python-instance</INST_NAME>"
-        "<PLUSET>{}s</PLUSET><EF>0s REPEAT 0 TIMES</EF>")
-
-    cond = cond_fmt.format(throttle.next_delay())
-
-    rule_fmt = (
-        "callback.async_api_bulk_data_obj_put_post('{}', '{}', '{}', '{}')")
-
-    rule = rule_fmt.format(
-        str(instance),
-        json.dumps(comm.map()),
-        json.dumps(boi_map),
-        str(bulk_opr_inp_b_buf.buf))
-
-    ctx.delayExec(cond, rule, "")
+    comm_json = _comm_projection(comm, _BULK_PUT_COMM_FIELDS)
+    boi_json = irods_extra.to_json(boi_map)
+    b_buf = str(bulk_opr_inp_b_buf.buf)
+    task = irods_extra.task_text(
+        'async_api_bulk_data_obj_put_post',
+        instance,
+        comm_json,
+        boi_json,
+        b_buf)
+    ctx.delayExec(irods_extra.delay_cond(throttle.next_delay()), task, "")
     return irods_errors.RULE_ENGINE_CONTINUE
 
 
@@ -6,11 +6,39 @@ This module ensures that every replica of every data object has a checksum.
 """
 
 import genquery  # type: ignore
-import json
 
 from yoda import rule
 
 from .. import irods_extra
+from .. import throttle
+
+
+# the GenQuery condition selecting a data object's replica on a resource
+_REPLICA_COND = irods_extra.DATA_COND + " and DATA_RESC_HIER = '%s'"
+
+# the GenQuery condition restricting a data object query to a resource
+_RESC_HIER_COND = "DATA_RESC_HIER = '%s'"
+
+
+def _checksum_replica(ctx, data_path, repl_num):
+    ret = ctx.msiDataObjChksum(data_path, "replNum={}".format(repl_num), '')
+
+    if not ret['status']:
+        msg_fmt = "Failed to generate checksum for replica {} of {} ({})"
+        msg = msg_fmt.format(repl_num, data_path, ret['code'])
+        ctx.writeLine('serverLog', msg)
+        return ret['code']
+
+    return irods_extra.SUCCESS
+
+
+def _sched_checksum_task(ctx, task):
+    ctx.delayExec(irods_extra.delay_cond(throttle.next_delay()), task, "")
+
+
+def _sched_checksum_replica(ctx, data_path, repl_num):
+    _sched_checksum_task(
+        ctx, irods_extra.task_text('checksum_replica', data_path, repl_num))
 
 
 def _ensure_replicas_checksum(ctx, data_path, resc_hier=""):
@@ -18,38 +46,65 @@ def _ensure_replicas_checksum(ctx, data_path, resc_hier=""):
         ret = ctx.msiDataObjChksum(data_path, "ChksumAll=", '')
 
         if not ret['status']:
-            msg_fmt = "Failed to generate checksum for the replicas of {} ({}}"
+            msg_fmt = "Failed to generate checksum for the replicas of {} ({})"
             msg = msg_fmt.format(data_path, ret['code'])
             ctx.writeLine('serverLog', msg)
+            return ret['code']
 
-        return ret
+        return irods_extra.SUCCESS
     else:
-        res = irods_extra.SUCCESS
+        # A data object has at most one replica on a given resource
+        # hierarchy. msiDataObjChksum won't accept resc_hier, so its replica
+        # number has to be looked up.
         (coll_path, data_name) = irods_extra.split_path(data_path)
+        cond = _REPLICA_COND % (coll_path, data_name, resc_hier)
+        repl_num = genquery.Query(ctx, 'DATA_REPL_NUM', cond).first()
+
+        if repl_num is None:
+            return irods_extra.SUCCESS
+
+        return _checksum_replica(ctx, data_path, repl_num)
 
-        cond_fmt = (
-            "COLL_NAME = '{}' and "
-            "DATA_NAME = '{}' and "
-            "DATA_RESC_HIER = '{}'")
 
-        cond = cond_fmt.format(coll_path, data_name, resc_hier)
+def _enqueue_checksum(ctx, data_path, resc_hier):
+    # Checksumming reads the entire replica, so the client shouldn't have to
+    # wait for it.
+    _sched_checksum_task(
+        ctx,
+        irods_extra.task_text(
+            'async_ensure_replicas_checksum', data_path, resc_hier))
 
-        for rec in genquery.Query(ctx, 'DATA_REPL_NUM', cond):
-            ret = ctx.msiDataObjChksum(data_path, "replNum={}".format(rec), '')
+    return irods_extra.SUCCESS
 
-            if not ret['status']:
-                msg_fmt = (
-                    "Failed to generate checksums for the replicas of {} "
-                    "on {} "
-                    "({})")
 
-                msg = msg_fmt.format(data_path, resc_hier, ret['code'])
-                ctx.writeLine('serverLog', msg)
+def _enqueue_bulk_checksums(ctx, data_paths, resc_hier):
+    recs = irods_extra.query_data_objs(
+        ctx, ('DATA_REPL_NUM',), data_paths, _RESC_HIER_COND % resc_hier)
 
-                if res == irods_extra.SUCCESS:
-                    res = ret['code']
+    for data_path, rec in recs:
+        _sched_checksum_replica(ctx, data_path, rec[0])
 
-        return res
+    return irods_extra.SUCCESS
+
+
+@rule.make([0,1])
+def async_ensure_replicas_checksum(ctx, data_path, resc_hier):
+    """Ensure the replicas of a data object on a resource have checksums.
+
+    If resc_hier is empty, every replica of the data object is checksummed.
+
+    NOTE: This is intended to be called by DelayExec.
+    """
+    return _ensure_replicas_checksum(ctx, data_path, resc_hier)
+
+
+@rule.make([0,1])
+def checksum_replica(ctx, data_path, repl_num):
+    """Generate the checksum of a single replica of a data object.
+
+    NOTE: This is intended to be called by DelayExec.
+    """
+    return _checksum_replica(ctx, data_path, repl_num)
 
 
 @rule.make(inputs=[0,1,2,3])
@@ -58,31 +113,30 @@ def async_api_bulk_data_obj_put_post(
 ):
     """Ensure every replica created or updated by bulk upload has a checksum.
 
-    If neither BulkOpInp.regChksum nor BulkOpInp.verifyChksum exist, calculate
-    the checksum of replica on BulkOpInp.resc_hier for each entry of
-    BulkOpInp.logical_path.
+    If neither BulkOpInp.regChksum nor BulkOpInp.verifyChksum exist, schedule
+    the calculation of the checksum of replica on BulkOpInp.resc_hier for each
+    entry of BulkOpInp.logical_path. Each checksum is its own delayed rule, so
+    the delay server can compute them concurrently.
     """
-    boi = json.loads(bulk_opr_inp_json)
+    boi = irods_extra.from_json(bulk_opr_inp_json)
     opts = boi['condInput']
-    res = irods_extra.SUCCESS
 
     if (
-        not irods_extra.has_key(opts, 'regChksum') and  # noqa
-        not irods_extra.has_key(opts, 'verifyChksum')
+        irods_extra.has_key(opts, 'regChksum') or  # noqa
+        irods_extra.has_key(opts, 'verifyChksum')
     ):
-        objs = [
-            boi['attriArray']['sqlResult'][0]['row'][r]
-            for r in range(boi['attriArray']['rowCnt'])]
+        return irods_extra.SUCCESS
 
-        resc = irods_extra.value(opts, 'resc_hier')
+    objs = irods_extra.unique(boi['attriArray']['sqlResult'][0]['row'])
+    resc = irods_extra.value(opts, 'resc_hier')
 
-        for obj in objs:
-            ret = _ensure_replicas_checksum(ctx, obj, resc)
+    if resc != '':
+        return _enqueue_bulk_checksums(ctx, objs, resc)
 
-            if ret < irods_extra.SUCCESS and res == irods_extra.SUCCESS:
-                res = ret
+    for obj in objs:
+        _enqueue_checksum(ctx, obj, resc)
 
-    return res
+    return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2,3])
@@ -90,11 +144,11 @@ def pep_api_data_obj_copy_post(ctx, _instance, _comm, data_obj_copy_inp, _):  #
     """Ensure every replica created or updated by copying has a checksum.
 
     If neither DataObjCopyInp.regChksum nor DataObjCopyInp.verifyChksum exist,
-    calculate the checksum of DataObjCopyInp.dst_obj_path on
+    schedule the calculation of the checksum of DataObjCopyInp.dst_obj_path on
     DataObjCopyInp.dst_resc_hier.
     """
     dest_obj = data_obj_copy_inp.destDataObjInp
-    dest_opts = dest_obj.condInput
+    dest_opts = irods_extra.to_dict(dest_obj.condInput)
 
     if (
         irods_extra.has_key(dest_opts, 'regChksum') or  # noqa
@@ -102,7 +156,7 @@ def pep_api_data_obj_copy_post(ctx, _instance, _comm, data_obj_copy_inp, _):  #
     ):
         return irods_extra.SUCCESS
 
-    return _ensure_replicas_checksum(
+    return _enqueue_checksum(
         ctx, str(dest_obj.objPath), irods_extra.value(dest_opts, 'resc_hier'))
 
 
@@ -111,9 +165,10 @@ def pep_api_data_obj_put_post(ctx, _instance, _comm, data_obj_inp, _):  # pyrigh
     """Ensure every replica created or updated by uploading has a checksum.
 
     If neither DataObjInp.regChksum nor DataObjInp.verifyChksum exist,
-    calculate the checksum of DataObjInp.obj_path on DataObjInp.resc_hier.
+    schedule the calculation of the checksum of DataObjInp.obj_path on
+    DataObjInp.resc_hier.
     """
-    opts = data_obj_inp.condInput
+    opts = irods_extra.to_dict(data_obj_inp.condInput)
 
     if (
         irods_extra.has_key(opts, 'regChksum') or  # noqa
@@ -121,7 +176,7 @@ def pep_api_data_obj_put_post(ctx, _instance, _comm, data_obj_inp, _):  # pyrigh
     ):
         return irods_extra.SUCCESS
 
-    return _ensure_replicas_checksum(
+    return _enqueue_checksum(
         ctx, str(data_obj_inp.objPath), irods_extra.value(opts, 'resc_hier'))
 
 
@@ -130,10 +185,10 @@ def pep_api_phy_path_reg_post(ctx, _instance, _, phy_path_reg_inp):  # pyright:
     """Ensure every replica added through registration has a checksum.
 
     If none of PhyPathRegInp.regRepl, PhyPathRegInp.regChksum, or
-    PhyPathRegInp.verifyChksum are set, calculate the checksum of replica of
-    PhyPathRegInp.obj_path on PhyPathRegInp.resc_hier.
+    PhyPathRegInp.verifyChksum are set, schedule the calculation of the
+    checksum of replica of PhyPathRegInp.obj_path on PhyPathRegInp.resc_hier.
     """
-    opts = phy_path_reg_inp.condInput
+    opts = irods_extra.to_dict(phy_path_reg_inp.condInput)
 
     if (
         irods_extra.has_key(opts, 'regRepl') or  # noqa
@@ -142,7 +197,7 @@ def pep_api_phy_path_reg_post(ctx, _instance, _, phy_path_reg_inp):  # pyright:
     ):
         return irods_extra.SUCCESS
 
-    return _ensure_replicas_checksum(
+    return _enqueue_checksum(
         ctx,
         str(phy_path_reg_inp.objPath),
         irods_extra.value(opts, 'resc_hier'))
@@ -157,59 +212,47 @@ def pep_api_touch_post(ctx, _instance, _, json_input):  # pyright: ignore
     set. If that's the case, check to see if the data object's 0 replica has a
     checksum. If it doesn't compute its checksum.
     """
-    inp = json.loads(str(json_input.buf))
-    opts = inp['options']
+    inp = irods_extra.from_json(str(json_input.buf))
 
-    if (
-        opts['no_create'] or
-        'replica_number' in opts or
-        'leaf_resource_name' in opts
-    ):
+    if not irods_extra.touch_may_create(inp):
         return irods_extra.SUCCESS
 
     data_path = inp['logical_path']
     (coll_path, data_name) = irods_extra.split_path(data_path)
-    cond = "COLL_NAME = '{}' and DATA_NAME = '{}'".format(coll_path, data_name)
-
-    for rec in genquery.Query(
-        ctx.callback, ("DATA_CHECKSUM", "DATA_RESC_HIER"), cond
-    ):
-        return (
-            _ensure_replicas_checksum(ctx, data_path, rec[1])
-            if rec[0] == ''
-            else irods_extra.SUCCESS)
-
+    cond = (
+        irods_extra.DATA_COND % (coll_path, data_name) +
+        " and DATA_REPL_NUM = '0'")
+
+    # Only the 0 replica matters, so let the catalog filter out the rest.
+    rec = genquery.Query(
+        ctx.callback,
+        ("DATA_CHECKSUM", "DATA_RESC_HIER"),
+        cond,
+        genquery.AS_LIST
+    ).first()
+
+    if rec is None or rec[0] != '':
+        return irods_extra.SUCCESS
 
-# NOTE: Ideally, this would be a map from data objects to property sets, since
-# multiple data objects can be uploaded concurrently using
-# data_obj_create/data_obj_open + data_obj_write + data_obj_close or
-# replica_open + data_obj_write + data_obj_close. Unfortunately, for the
-# data_obj_write doesn't know the data object's Id or path, and data_obj_open
-# doesn't know the data objects l1descInx, so there's know way to be sure that
-# data object handled by a given data_obj_open call is the same as that being
-# handled by a subsequent data_obj_write call.
-__write_props = {}
+    return _ensure_replicas_checksum(ctx, data_path, rec[1])
 
 
 @rule.make(inputs=[0,1,2])
-def pep_api_data_obj_create_post(_ctx, _instance, _, data_obj_inp):  # pyright: ignore
+def pep_api_data_obj_create_post(_ctx, _instance, _comm, data_obj_inp):  # pyright: ignore
     """Ensure every data object added through creation has a checksum.
 
     Always compute the checksum. Store the path to the data object and the
-    selected resource hierarchy for its replica in __write_props using the keys
-    'data_path' and 'resc_hier', respectively. Also, set the key
-    'needs_checksum' to True. If needed, data_obj_close will use these keys to
+    selected resource hierarchy for its replica in the write properties using
+    the keys 'data_path' and 'resc_hier', respectively. Also, set the key
+    'created' to True. If needed, data_obj_close will use these keys to
     compute the checksum of the indicated replica.
     """
-    opts = data_obj_inp.condInput
-    __write_props['data_path'] = str(data_obj_inp.objPath)
-    __write_props['resc_hier'] = irods_extra.value(opts, 'resc_hier')
-    __write_props['needs_checksum'] = True
+    irods_extra.record_create(__name__, data_obj_inp)
     return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2])
-def pep_api_data_obj_open_post(_ctx, _instance, _, data_obj_inp):  # pyright: ignore
+def pep_api_data_obj_open_post(_ctx, _instance, _comm, data_obj_inp):  # pyright: ignore
     """Ensure every data object created or modified by opening has a checksum.
 
     A checksum can only be computed after the replica has been modified, so
@@ -222,44 +265,22 @@ def pep_api_data_obj_open_post(_ctx, _instance, _, data_obj_inp):  # pyright: ig
     is written to, it has also been modified, so  data_obj_write stores a flag
     to let data_obj_close know this has happened.
     """
-    flags = str(data_obj_inp.openFlags)
-    opts = data_obj_inp.condInput
-    __write_props['data_path'] = str(data_obj_inp.objPath)
-    __write_props['resc_hier'] = irods_extra.value(opts, 'resc_hier')
-
-    if flags == irods_extra.OPEN_FLAG_R:
-        __write_props['needs_checksum'] = False
-    else:
-        __write_props['needs_checksum'] = (
-            irods_extra.value(opts, 'openType') == irods_extra.FILE_CREATE or
-            irods_extra.replica_truncated(flags))
-
+    irods_extra.record_open(__name__, data_obj_inp)
     return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2], outputs=[3])
-def pep_api_replica_open_post(_ctx, _instance, _, data_obj_inp):  # pyright: ignore
+def pep_api_replica_open_post(_ctx, _instance, _comm, data_obj_inp):  # pyright: ignore
     """Ensure a replica created or modified through replica API has checksum.
 
     When replica_open is called, store DataObjInp.destRescName and
-    DataObjInp.obj_path in __write_props. If a data object is created or
-    truncated, or if data_obj_write is called, it is assumed the data object
+    DataObjInp.obj_path in the write properties. If a data object is created
+    or truncated, or if data_obj_write is called, it is assumed the data object
     has been modified. When replica_close is called, if the data object was
     modified and if JsonInput.buf.compute_checksum isn't true, it will
     compute the checksum of obj_path on destRescName.
     """
-    flags = str(data_obj_inp.openFlags)
-    opts = data_obj_inp.condInput
-    __write_props['data_path'] = str(data_obj_inp.objPath)
-    __write_props['resc_hier'] = irods_extra.value(opts, 'resc_hier')
-
-    if flags == irods_extra.OPEN_FLAG_R:
-        __write_props['needs_checksum'] = False
-    else:
-        __write_props['needs_checksum'] = (
-            irods_extra.value(opts, 'openType') == irods_extra.FILE_CREATE or
-            irods_extra.replica_truncated(flags))
-
+    irods_extra.record_open(__name__, data_obj_inp)
     return irods_extra.SUCCESS
 
 
@@ -268,45 +289,48 @@ def pep_api_data_obj_write_post(
     _ctx, _instance, _comm, _data_obj_write_inp, _  # pyright: ignore
 ):
     """See data_obj_open and replica_opne for more details."""
-    __write_props['needs_checksum'] = True
+    irods_extra.write_props(__name__)['modified'] = True
     return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2])
 def pep_api_data_obj_close_post(ctx, _instance, _comm, _):  # pyright: ignore
     """See data_obj_create and data_obj_open for more details."""
-    if 'data_path' not in __write_props:
+    props = irods_extra.write_props(__name__)
+
+    if 'data_path' not in props:
         return irods_extra.SUCCESS
 
-    if not __write_props['needs_checksum']:
+    if not (props['created'] or props['modified']):
         return irods_extra.SUCCESS
 
-    return _ensure_replicas_checksum(
-        ctx, __write_props['data_path'], __write_props['resc_hier'])
+    return _enqueue_checksum(ctx, props['data_path'], props['resc_hier'])
 
 
 @rule.make(inputs=[0,1,2])
 def pep_api_data_obj_close_finally(_ctx, _instance, _comm, _):  # pyright: ignore
-    """Reset __write_props in case it's needed again in the current session."""
-    __write_props.clear()
+    """Reset the write properties in case they're needed again this session."""
+    irods_extra.reset_write_props(__name__)
     return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2])
-def pep_api_replica_close_post(ctx, _instance, _, json_input):  # pyright: ignore
+def pep_api_replica_close_post(ctx, _instance, _comm, json_input):  # pyright: ignore
     """See replica_open for details."""
-    if __write_props['needs_checksum']:
-        inp = json.loads(str(json_input.buf))
+    props = irods_extra.write_props(__name__)
+
+    if props.get('created') or props.get('modified'):
+        inp = irods_extra.from_json(str(json_input.buf))
 
         if 'compute_checksum' not in inp or not inp['compute_checksum']:
-            return _ensure_replicas_checksum(
-                ctx, __write_props['data_path'], __write_props['resc_hier'])
+            return _enqueue_checksum(
+                ctx, props['data_path'], props['resc_hier'])
 
     return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2])
-def pep_api_replica_close_post(ctx, _instance, _comm, _):  # pyright: ignore
-    """Reset __write_props in case it's needed again in this session."""
-    __write_props.clear()
+def pep_api_replica_close_finally(_ctx, _instance, _comm, _):  # pyright: ignore
+    """Reset the write properties in case they're needed again this session."""
+    irods_extra.reset_write_props(__name__)
     return irods_extra.SUCCESS
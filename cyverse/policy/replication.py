@@ -9,16 +9,20 @@ This rule base uses the resource set by the "default_resource_name" field in
 /etc/irods/server_config.json as the resource used to store the first replica
 of a newly created data object. It is also know as the primary resource.  To
 determine the resource to use for the second replica, the rule base uses the
-value of the AVU "cyverse::replica-resource" that is attached to the primary
-resource. If this AVU is not present, no replication will occur.
-
-NOTE: This rule base assumes that every replica has a checksum, so the
-corresponding checksum rules should be successfully executed first.
+value of the AVU "ipc::replica-resource" that is attached to the primary
+resource. The residency rule base owns this attribute and its lookup. If this
+AVU is not present, no replication will occur.
+
+NOTE: The checksum rules compute checksums asynchronously, so they may not have
+run yet when a data object is replicated. The replicas of a data object are
+only copied once its good replicas have checksums, so that the copies can be
+verified. The bulk upload and batch rules give the checksum rules time to
+finish by deferring such a data object. A task replicating a single data
+object computes a missing checksum itself.
 """
 
 import genquery  # type: ignore
 import irods_errors  # type: ignore
-import json
 
 from yoda import rule
 
@@ -28,131 +32,376 @@ from .. import throttle
 import residency
 
 
+# the GenQuery condition selecting a data object by Id
+_DATA_ID_COND = "DATA_ID = '%s'"
+
+
 def _query_data_id(ctx, data_path):
     [coll_path, data_name] = irods_extra.split_path(data_path)
-    for rec in genquery.Query(
-        ctx.callback,
-        'DATA_ID',
-        "COLL_NAME = '{}' and DATA_NAME = '{}'".format(coll_path, data_name)
-    ):
-        return rec
-
-    return None
-
-
-def _query_data_path(ctx, data_id):
-    for rec in genquery.Query(
-        ctx.callback,
-        ('COLL_NAME', 'DATA_NAME'),
-        "DATA_ID = '{}'".format(data_id),
-        genquery.AS_LIST
-    ):
-        return "{}/{}".format(*rec)
-
-    return None
-
-
-def _resolve_replicate_issue(ctx, code, data_path, dest_resc):
-    if (
-        code in [
-            irods_errors.CAT_NOT_ROWS_FOUND, irods_errors.CAT_UNKNOWN_FILE]
-    ):
-        ctx.writeLine(
-            'serverLog',
-            "failed to replicate {}, no longer exists".format(data_path))
-        return irods_extra.SUCCESS
-    elif code == irods_errors.SYS_NOT_ALLOWED:
-        # Replicas already up to date
-        return irods_extra.SUCCESS
-    elif code == irods_errors.SYS_RESC_DOES_NOT_EXIST:
-        msg_fmt = (
-            "failed to replicate {}, destination resource {} no longer exists"
-        )
+    return genquery.Query(
+        ctx.callback, 'DATA_ID', irods_extra.DATA_COND % (coll_path, data_name)
+    ).first()
 
-        ctx.writeLine('serverLog', msg_fmt.format(data_path, dest_resc))
-        return irods_extra.SUCCESS
-    elif code == irods_errors.USER_CHKSUM_MISMATCH:
-        msg_fmt = "failed to replicate {}, source replica has bad checksum"
-        ctx.writeLine('serverLog', msg_fmt.format(data_path))
-        return irods_extra.SUCCESS
+
+def _is_checksummed(replicas):
+    # replicas holds the status and the checksum of each replica. Only the
+    # good replicas can be the source of a replication.
+    return all(chksum for status, chksum in replicas if status == '1')
+
+
+def _query_data_obj(ctx, data_id):
+    # It returns the data object's path and whether its good replicas have
+    # checksums, or None and False if the data object no longer exists.
+    cols = ('COLL_NAME', 'DATA_NAME', 'DATA_REPL_STATUS', 'DATA_CHECKSUM')
+    recs = list(genquery.Query(ctx.callback, cols, _DATA_ID_COND % data_id))
+
+    if not recs:
+        return None, False
+
+    data_path = "{}/{}".format(recs[0][0], recs[0][1])
+    return data_path, _is_checksummed([rec[2:] for rec in recs])
+
+
+def _get_repl_resc(ctx, resc_hier):
+    return residency.get_repl_resc(ctx, irods_extra.root_resc(resc_hier))
+
+
+# The replication failures that won't be fixed by trying again, mapped to the
+# message logged for each, if any. The messages are formatted with the data
+# object path and the destination resource.
+_REPL_ISSUES = {
+    irods_errors.CAT_NOT_ROWS_FOUND:
+        "failed to replicate {0}, no longer exists",
+    irods_errors.CAT_UNKNOWN_FILE:
+        "failed to replicate {0}, no longer exists",
+    # Replicas already up to date
+    irods_errors.SYS_NOT_ALLOWED: None,
+    irods_errors.SYS_RESC_DOES_NOT_EXIST:
+        "failed to replicate {0}, destination resource {1} no longer exists",
+    irods_errors.USER_CHKSUM_MISMATCH:
+        "failed to replicate {0}, source replica has bad checksum",
+}
+
+
+# The functions below that take a log argument append their messages to it
+# when it's a list, so that a rule handling many data objects can write them
+# to the server log all at once with _flush_log. Otherwise, the messages are
+# written as they happen.
+
+
+def _log(ctx, log, msg):
+    if log is None:
+        ctx.writeLine('serverLog', msg)
     else:
-        ctx.writeLine(
-            'serverLog',
+        log.append(msg)
+
+
+def _flush_log(ctx, log):
+    if log:
+        ctx.writeLine('serverLog', '\n'.join(log))
+
+
+def _resolve_replicate_issue(ctx, code, data_path, dest_resc, log=None):
+    if code not in _REPL_ISSUES:
+        _log(
+            ctx,
+            log,
             "Failed to replicate {}, trying again later".format(data_path))
         return code
 
+    msg_fmt = _REPL_ISSUES[code]
+
+    if msg_fmt:
+        _log(ctx, log, msg_fmt.format(data_path, dest_resc))
+
+    return irods_extra.SUCCESS
+
 
-def _replicate_with_path(ctx, data_path, dest_resc):
+def _replicate_with_path(ctx, data_path, dest_resc, log=None):
     ret = ctx.msiDataObjRepl(
         data_path, "backupRescName={}++++verifyChksum=".format(dest_resc), 0)
 
     if not ret['status']:
-        return _resolve_replicate_issue(ctx, ret['code'], data_path, dest_resc)
+        return _resolve_replicate_issue(
+            ctx, ret['code'], data_path, dest_resc, log)
 
     return irods_extra.SUCCESS
 
 
-def _sync_replicas_with_path(ctx, data_path):
+def _sync_replicas_with_path(ctx, data_path, log=None):
     ret = ctx.msiDataObjRepl(
         data_path, "all=++++updateRepl=++++verifyChksum=", 0)
 
     if not ret['status']:
-        return _resolve_replicate_issue(ctx, ret['code'], data_path, None)
+        return _resolve_replicate_issue(ctx, ret['code'], data_path, None, log)
 
     return irods_extra.SUCCESS
 
 
-@rule.make([1,2])
-def replicate(ctx, data_id, dest_resc):
+def _guarded(ctx, action, data_id, *args, **kwargs):
+    # A delayed rule runs only once, so an exception escaping it would lose
+    # its retry. Treat an exception like any other failure instead.
+    try:
+        return action(ctx, data_id, *args, **kwargs)
+    except Exception as e:
+        msg_fmt = "Failed to replicate data object {} ({}), trying again later"
+        _log(ctx, kwargs.get('log'), msg_fmt.format(data_id, e))
+        return irods_errors.SYS_INTERNAL_ERR
+
+
+# The functions below handle a single data object. If the checksum rules
+# haven't gotten to its source replica yet, they compute the checksum before
+# replicating, so that the new replica can be verified.
+
+
+def _replicate(ctx, data_id, dest_resc, log=None):
+    data_path, checksummed = _query_data_obj(ctx, data_id)
+
+    if not data_path:
+        return irods_extra.SUCCESS
+
+    if not checksummed:
+        ret = ctx.msiDataObjChksum(data_path, '', '')
+
+        if not ret['status']:
+            return _resolve_replicate_issue(
+                ctx, ret['code'], data_path, dest_resc, log)
+
+    return _replicate_with_path(ctx, data_path, dest_resc, log)
+
+
+def _sync_replicas(ctx, data_id, log=None):
+    data_path, checksummed = _query_data_obj(ctx, data_id)
+
+    if not data_path:
+        return irods_extra.SUCCESS
+
+    if not checksummed:
+        ret = ctx.msiDataObjChksum(data_path, '', '')
+
+        if not ret['status']:
+            return _resolve_replicate_issue(
+                ctx, ret['code'], data_path, None, log)
+
+    return _sync_replicas_with_path(ctx, data_path, log)
+
+
+# The functions below handle one data object from a batch. Computing a missing
+# checksum would hold up the rest of the batch, so a data object whose source
+# replica still has no checksum is handed off to a task of its own instead.
+
+
+def _replicate_in_batch(ctx, data_id, dest_resc, log=None):
+    data_path, checksummed = _query_data_obj(ctx, data_id)
+
+    if not data_path:
+        return irods_extra.SUCCESS
+
+    if not checksummed:
+        _sched_repl_task(ctx, _replication_task(data_id, dest_resc, 0))
+        return irods_extra.SUCCESS
+
+    return _replicate_with_path(ctx, data_path, dest_resc, log)
+
+
+def _sync_replicas_in_batch(ctx, data_id, log=None):
+    data_path, checksummed = _query_data_obj(ctx, data_id)
+
+    if not data_path:
+        return irods_extra.SUCCESS
+
+    if not checksummed:
+        _sched_repl_task(ctx, _sync_task(data_id, 0))
+        return irods_extra.SUCCESS
+
+    return _sync_replicas_with_path(ctx, data_path, log)
+
+
+# the number of seconds to wait before retrying a failed replication task the
+# first time, doubled for each later retry
+_RETRY_DELAY = 8 * 60 * 60
+
+# the longest number of seconds to wait between retries
+_MAX_RETRY_DELAY = 7 * 24 * 60 * 60
+
+# The number of seconds to give the checksum rules before replicating data
+# objects whose source replicas are still missing checksums. The checksum tasks
+# are staggered by up to throttle.MAX_DELAY seconds.
+_CHECKSUM_WAIT = 2 * throttle.MAX_DELAY
+
+
+def _retry_delay(attempt):
+    if attempt == 0:
+        return 0
+
+    # Past this many doublings, the delay is capped anyway.
+    doublings = min(attempt - 1, 5)
+    return min(_RETRY_DELAY * 2 ** doublings, _MAX_RETRY_DELAY)
+
+
+def _sched_repl_task(ctx, task, delay=0):
+    ctx.delayExec(
+        irods_extra.delay_cond(delay + throttle.next_delay()), task, "")
+
+
+def _replication_task(data_id, dest_resc, attempt):
+    return irods_extra.task_text('replicate', data_id, dest_resc, attempt)
+
+
+def _sync_task(data_id, attempt):
+    return irods_extra.task_text('sync_replicas', data_id, attempt)
+
+
+def _sched_replication(ctx, data_id, dest_resc):
+    _sched_repl_task(ctx, _replication_task(data_id, dest_resc, 0))
+
+
+def _sched_sync_replicas(ctx, data_id):
+    _sched_repl_task(ctx, _sync_task(data_id, 0))
+
+
+# the longest comma-separated list of data object Ids put in one delayed rule
+_MAX_BATCH_LEN = 1000
+
+
+def _id_batches(data_ids):
+    batch = []
+    batch_len = 0
+
+    for data_id in data_ids:
+        if batch and batch_len + len(data_id) > _MAX_BATCH_LEN:
+            yield ','.join(batch)
+            batch = []
+            batch_len = 0
+
+        batch.append(data_id)
+        batch_len += len(data_id) + 1
+
+    if batch:
+        yield ','.join(batch)
+
+
+def _sched_replications(ctx, data_ids, dest_resc, attempt=0, wait=0):
+    delay = _retry_delay(attempt) + wait
+
+    for batch in _id_batches(data_ids):
+        task = irods_extra.task_text(
+            'replicate_many', batch, dest_resc, attempt)
+
+        _sched_repl_task(ctx, task, delay)
+
+
+def _sched_syncs(ctx, data_ids, attempt=0, wait=0):
+    delay = _retry_delay(attempt) + wait
+
+    for batch in _id_batches(data_ids):
+        task = irods_extra.task_text('sync_replicas_many', batch, attempt)
+        _sched_repl_task(ctx, task, delay)
+
+
+# NOTE: The delayed rules below take all of their arguments, so that tasks
+#       queued before the attempt argument was added still run.
+
+
+@rule.make()
+def replicate(ctx, data_id, dest_resc, attempt='0'):
     """Replicate a data object.
 
+    attempt is the number of earlier failed tries. If this try fails too, it
+    is retried after a delay that doubles with each attempt, up to a week.
+
     NOTE: This is intended to be called by DelayExec.
     """
-    data_path = _query_data_path(ctx, data_id)
+    if _guarded(ctx, _replicate, data_id, dest_resc) < irods_extra.SUCCESS:
+        next_attempt = int(attempt) + 1
 
-    return (
-        _replicate_with_path(ctx, data_path, dest_resc) if data_path
-        else irods_extra.SUCCESS)
+        _sched_repl_task(
+            ctx,
+            _replication_task(data_id, dest_resc, next_attempt),
+            _retry_delay(next_attempt))
+
+    return irods_extra.SUCCESS
 
 
-@rule.make([1])
-def sync_replicas(ctx, data_id):
+@rule.make()
+def sync_replicas(ctx, data_id, attempt='0'):
     """Update all data object replicas to current version.
 
+    attempt is the number of earlier failed tries. If this try fails too, it
+    is retried after a delay that doubles with each attempt, up to a week.
+
     NOTE: This is intended to be called by DelayExec.
     """
-    data_path = _query_data_path(ctx, data_id)
+    if _guarded(ctx, _sync_replicas, data_id) < irods_extra.SUCCESS:
+        next_attempt = int(attempt) + 1
 
-    return (
-        _sync_replicas_with_path(ctx, data_path) if data_path
-        else irods_extra.SUCCESS)
+        _sched_repl_task(
+            ctx, _sync_task(data_id, next_attempt), _retry_delay(next_attempt))
 
+    return irods_extra.SUCCESS
 
-def _sched_repl_task(ctx, task):
-    cond_fmt = (
-        "<INST_NAME>irods_rule_engine_plugin-python-instance</INST_NAME>"
-        "<PLUSET>{}s</PLUSET><EF>8h REPEAT UNTIL SUCCESS</EF>")
 
-    ctx.delayExec(cond_fmt.format(throttle.next_delay()), task, "")
+@rule.make()
+def replicate_many(ctx, data_ids, dest_resc, attempt='0'):
+    """Replicate a batch of data objects.
 
+    data_ids is a comma-separated list of data object Ids, and attempt is the
+    number of earlier failed tries of the batch. The data objects that fail
+    to replicate are retried together as a new batch after a delay that
+    doubles with each attempt, up to a week. The data objects whose source
+    replicas are missing checksums are replicated by their own tasks.
 
-def _sched_replication(ctx, data_id, dest_resc):
-    _sched_repl_task(
-        ctx, "callback.replicate('{}', '{}')".format(data_id, dest_resc))
+    NOTE: This is intended to be called by DelayExec.
+    """
+    log = []
 
+    failed = [
+        i for i in data_ids.split(',')
+        if _guarded(ctx, _replicate_in_batch, i, dest_resc, log=log)
+        < irods_extra.SUCCESS]
 
-def _try_replicate(ctx, data_path, dest_resc):
-    if _replicate_with_path(ctx, data_path, dest_resc) < irods_extra.SUCCESS:
-        _sched_replication(ctx, _query_data_id(ctx, data_path), dest_resc)
+    _flush_log(ctx, log)
+    _sched_replications(ctx, failed, dest_resc, int(attempt) + 1)
+    return irods_extra.SUCCESS
 
 
-def _sched_sync_replicas(ctx, data_id):
-    _sched_repl_task(ctx, "callback.sync_replicas('{}')".format(data_id))
+@rule.make()
+def sync_replicas_many(ctx, data_ids, attempt='0'):
+    """Update the replicas of a batch of data objects to current version.
+
+    data_ids is a comma-separated list of data object Ids, and attempt is the
+    number of earlier failed tries of the batch. The data objects that fail
+    to be updated are retried together as a new batch after a delay that
+    doubles with each attempt, up to a week. The data objects whose source
+    replicas are missing checksums are updated by their own tasks.
+
+    NOTE: This is intended to be called by DelayExec.
+    """
+    log = []
+
+    failed = [
+        i for i in data_ids.split(',')
+        if _guarded(ctx, _sync_replicas_in_batch, i, log=log)
+        < irods_extra.SUCCESS]
+
+    _flush_log(ctx, log)
+    _sched_syncs(ctx, failed, int(attempt) + 1)
+    return irods_extra.SUCCESS
+
 
+def _try_replicate(ctx, data_path, dest_resc, log):
+    return (
+        _replicate_with_path(ctx, data_path, dest_resc, log)
+        >= irods_extra.SUCCESS)
+
+
+def _try_sync_replicas(ctx, data_path, log):
+    return _sync_replicas_with_path(ctx, data_path, log) >= irods_extra.SUCCESS
 
-def _try_sync_replicas(ctx, data_path):
-    if _sync_replicas_with_path(ctx, data_path) < irods_extra.SUCCESS:
-        _sched_sync_replicas(ctx, _query_data_id(ctx, data_path))
+
+def _query_data_ids(ctx, data_paths):
+    data_ids = [_query_data_id(ctx, p) for p in data_paths]
+    return [i for i in data_ids if i is not None]
 
 
 @rule.make(inputs=[0,1,2,3])
@@ -162,38 +411,79 @@ def async_api_bulk_data_obj_put_post(
     """Ensure bulk uploaded data objects have two good replicas.
 
     Every replica created by bulk upload, gets replicated, and every one that
-    gets overriden, gets its peer replica updated. If the first attempt at
-    replicating or updating fails, schedule the task to be retried every 8
-    hours until it succeeds.
+    gets overriden, gets its peer replica updated. The data objects whose
+    first attempt at replicating or updating fails are gathered into batches,
+    and each batch is scheduled to be retried until it succeeds. The data
+    objects whose source replicas are still waiting on the checksum rules are
+    batched the same way, but the batches are delayed to give those rules time
+    to finish.
     """
-    boi = json.loads(bulk_opr_inp_json)
+    boi = irods_extra.from_json(bulk_opr_inp_json)
     opts = boi['condInput']
 
-    repl_resc = residency.get_repl_resc(
-        ctx, irods_extra.root_resc(irods_extra.value(opts, 'resc_hier')))
-
-    objs = [
-        boi['attriArray']['sqlResult'][0]['row'][r]
-        for r in range(boi['attriArray']['rowCnt'])]
+    repl_resc = _get_repl_resc(ctx, irods_extra.value(opts, 'resc_hier'))
+    force = irods_extra.has_key(opts, 'forceFlag')  # noqa
 
-    if irods_extra.has_key(opts, 'forceFlag'):  # noqa
-        for obj in objs:
-            (coll_path, data_name) = irods_extra.split_path(obj)
-
-            cond = "COLL_NAME = '{}' and DATA_NAME = '{}'".format(
-                coll_path, data_name)
+    if not (repl_resc or force):
+        return irods_extra.SUCCESS
 
-            for rec in genquery.Query(
-                ctx.callback, ('DATA_CREATE_TIME', 'DATA_MODIFY_TIME'), cond
-            ):
-                if rec[0] == rec[1]:
-                    if repl_resc:
-                        _try_replicate(ctx, obj, repl_resc)
-                else:
-                    _try_sync_replicas(ctx, obj)
-    elif repl_resc:
-        for obj in objs:
-            _try_replicate(ctx, obj, repl_resc)
+    objs = irods_extra.unique(boi['attriArray']['sqlResult'][0]['row'])
+    cols = (
+        'DATA_CREATE_TIME',
+        'DATA_MODIFY_TIME',
+        'DATA_REPL_STATUS',
+        'DATA_CHECKSUM')
+
+    # for each data object, whether each of its replicas is unmodified since
+    # creation, and the status and checksum of each of its replicas
+    unmodified = {}
+    replicas = {}
+
+    for obj, rec in irods_extra.query_data_objs(ctx, cols, objs):
+        unmodified.setdefault(obj, []).append(rec[0] == rec[1])
+        replicas.setdefault(obj, []).append(rec[2:])
+
+    to_replicate = []
+    to_sync = []
+
+    for obj, repls in unmodified.items():
+        if not force or all(repls):
+            if repl_resc:
+                to_replicate.append(obj)
+        elif len(repls) > 1:
+            # A lone replica has no peer to bring up to date.
+            to_sync.append(obj)
+
+    unreplicated = []
+    unsynced = []
+    unchecksummed_repls = []
+    unchecksummed_syncs = []
+    log = []
+
+    for obj in to_replicate:
+        if not _is_checksummed(replicas[obj]):
+            unchecksummed_repls.append(obj)
+        elif not _try_replicate(ctx, obj, repl_resc, log):
+            unreplicated.append(obj)
+
+    for obj in to_sync:
+        if not _is_checksummed(replicas[obj]):
+            unchecksummed_syncs.append(obj)
+        elif not _try_sync_replicas(ctx, obj, log):
+            unsynced.append(obj)
+
+    _flush_log(ctx, log)
+    _sched_replications(ctx, _query_data_ids(ctx, unreplicated), repl_resc)
+    _sched_syncs(ctx, _query_data_ids(ctx, unsynced))
+
+    _sched_replications(
+        ctx,
+        _query_data_ids(ctx, unchecksummed_repls),
+        repl_resc,
+        wait=_CHECKSUM_WAIT)
+
+    _sched_syncs(
+        ctx, _query_data_ids(ctx, unchecksummed_syncs), wait=_CHECKSUM_WAIT)
 
     return irods_extra.SUCCESS
 
@@ -206,13 +496,12 @@ def pep_api_data_obj_copy_post(ctx, _instance, _comm, data_obj_copy_inp, _):  #
     this way, gets its peer replica asynchronously updated.
     """
     dest_obj = data_obj_copy_inp.destDataObjInp
-    dest_opts = dest_obj.condInput
+    dest_opts = irods_extra.to_dict(dest_obj.condInput)
     dest_path = str(dest_obj.objPath)
 
     if irods_extra.value(dest_opts, 'openType') == irods_extra.FILE_CREATE:
-        repl_resc = residency.get_repl_resc(
-            ctx,
-            irods_extra.root_resc(irods_extra.value(dest_opts, 'resc_hier')))
+        repl_resc = _get_repl_resc(
+            ctx, irods_extra.value(dest_opts, 'resc_hier'))
 
         if repl_resc:
             _sched_replication(ctx, _query_data_id(ctx, dest_path), repl_resc)
@@ -229,12 +518,12 @@ def pep_api_data_obj_put_post(ctx, _instance, _comm, data_obj_inp, _):  # pyrigh
     A replica created this way gets asynchrounously replicated. One modified
     this way, gets its peer replica asynchronously updated.
     """
-    opts = data_obj_inp.condInput
+    opts = irods_extra.to_dict(data_obj_inp.condInput)
     path = str(data_obj_inp.objPath)
 
     if irods_extra.value(opts, 'openType') == irods_extra.FILE_CREATE:
-        repl_resc = residency.get_repl_resc(
-            ctx, irods_extra.root_resc(irods_extra.value(opts, 'resc_hier')))
+        repl_resc = _get_repl_resc(
+            ctx, irods_extra.value(opts, 'resc_hier'))
 
         if repl_resc:
             _sched_replication(ctx, _query_data_id(ctx, path), repl_resc)
@@ -252,14 +541,14 @@ def pep_api_phy_path_reg_post(ctx, _instance, _, phy_path_reg_inp):  # pyright:
     registration added a replica to an existing data object, update the peer
     replica.
     """
-    opts = phy_path_reg_inp.condInput
+    opts = irods_extra.to_dict(phy_path_reg_inp.condInput)
     path = str(phy_path_reg_inp.objPath)
 
     if irods_extra.has_key(opts, 'regRepl'):  # noqa
         _sched_sync_replicas(ctx, _query_data_id(ctx, path))
     else:
-        repl_resc = residency.get_repl_resc(
-            ctx, irods_extra.root_resc(irods_extra.value(opts, 'resc_hier')))
+        repl_resc = _get_repl_resc(
+            ctx, irods_extra.value(opts, 'resc_hier'))
 
         if repl_resc:
             _sched_replication(ctx, _query_data_id(ctx, path), repl_resc)
@@ -270,54 +559,54 @@ def pep_api_phy_path_reg_post(ctx, _instance, _, phy_path_reg_inp):  # pyright:
 @rule.make(inputs=[0,1,2])
 def pep_api_touch_post(ctx, _instance, _, json_input):  # pyright: ignore
     """Ensure replica created through touching, gets replicated."""
-    inp = json.loads(str(json_input.buf))
-    opts = inp['options']
+    inp = irods_extra.from_json(str(json_input.buf))
+
+    # Only a touch that may have created the data object matters.
+    if not irods_extra.touch_may_create(inp):
+        return irods_extra.SUCCESS
 
-    if (
-        not opts['no_create'] and
-        'replica_number' not in opts or
-        'leaf_resource_name' not in opts
-    ):
-        coll_path, data_name = irods_extra.split_path(inp['logical_path'])
+    coll_path, data_name = irods_extra.split_path(inp['logical_path'])
 
-        cols = (
-            "DATA_ID",
-            'DATA_CREATE_TIME',
-            'DATA_MODIFY_TIME',
-            'DATA_RESC_HIER')
+    cols = (
+        "DATA_ID",
+        'DATA_CREATE_TIME',
+        'DATA_MODIFY_TIME',
+        'DATA_RESC_HIER')
 
-        cond = "COLL_NAME = '{}' and DATA_NAME = '{}'".format(
-            coll_path, data_name)
+    cond = irods_extra.DATA_COND % (coll_path, data_name)
 
-        for rec in genquery.Query(ctx.callback, cols, cond):
-            if rec[1] == rec[2]:
-                repl_resc = residency.get_repl_resc(
-                    ctx, irods_extra.root_resc(rec[3]))
+    for rec in genquery.Query(ctx.callback, cols, cond):
+        if rec[1] == rec[2]:
+            repl_resc = _get_repl_resc(ctx, rec[3])
 
-                if repl_resc:
-                    _sched_replication(ctx, rec[0], repl_resc)
+            if repl_resc:
+                _sched_replication(ctx, rec[0], repl_resc)
 
     return irods_extra.SUCCESS
 
 
-# NOTE: Ideally, this would be a map from data objects to property sets, since
-# multiple data objects can be uploaded concurrently using
-# data_obj_create/data_obj_open + data_obj_write + data_obj_close or
-# replica_open + data_obj_write + data_obj_close. Unfortunately, for the
-# data_obj_write doesn't know the data object's Id or path, and data_obj_open
-# doesn't know the data objects l1descInx, so there's know way to be sure that
-# data object handled by a given data_obj_open call is the same as that being
-# handled by a subsequent data_obj_write call.
-__write_props = {}
+def _replicate_on_close(ctx):
+    props = irods_extra.write_props(__name__)
+
+    if props.get('created'):
+        repl_resc = _get_repl_resc(ctx, props['resc_hier'])
+
+        if repl_resc:
+            _sched_replication(
+                ctx, _query_data_id(ctx, props['data_path']), repl_resc)
+    elif props.get('modified'):
+        _sched_sync_replicas(ctx, _query_data_id(ctx, props['data_path']))
+
+    return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2])
-def pep_api_data_obj_create_post(_ctx, _instance, _, data_obj_inp):  # pyright: ignore
+def pep_api_data_obj_create_post(_ctx, _instance, _comm, data_obj_inp):  # pyright: ignore
     """Ensure data object added through creation has two up-to-date replicas.
 
     The work will be done in data_obj_close. To pass the required information
-    along to data_obj_close, the following entries ared added to the global
-    dict __write_props.
+    along to data_obj_close, the following entries ared added to the write
+    properties.
 
     'data_path'  the absolute path to the data object
     'resc_hier'  the storage resource of the original replica
@@ -325,75 +614,45 @@ def pep_api_data_obj_create_post(_ctx, _instance, _, data_obj_inp):  # pyright:
     'modified'   False (indicates the data object wasn't modified after
                  creation)
     """
-    opts = data_obj_inp.condInput
-    __write_props['data_path'] = str(data_obj_inp.objPath)
-    __write_props['resc_hier'] = irods_extra.value(opts, 'resc_hier')
-    __write_props['created'] = True
-    __write_props['modified'] = False
+    irods_extra.record_create(__name__, data_obj_inp)
     return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2])
-def pep_api_data_obj_open_post(_ctx, _instance, _, data_obj_inp):  # pyright: ignore
+def pep_api_data_obj_open_post(_ctx, _instance, _comm, data_obj_inp):  # pyright: ignore
     """Ensure data object editted by writing has two up-to-date replicas.
 
     If a data object was created, replica its original replica. If a data
     object was modified, ensure the unmodified replica is updated. The work
     will be done in data_obj_write and data_obj_close. To pass the required
     information along to these rules, the following entries are added to the
-    global dict __write_props.
+    write properties.
 
     'data_path'  the absolute path to the data object
     'resc_hier'  the storage resource of the created or modified replica
     'created'    whether or not the data object was created
     'modified'   whether or not the data object has been modified
     """
-    flags = str(data_obj_inp.openFlags)
-    opts = data_obj_inp.condInput
-    __write_props['data_path'] = str(data_obj_inp.objPath)
-    __write_props['resc_hier'] = irods_extra.value(opts, 'resc_hier')
-
-    if flags == irods_extra.OPEN_FLAG_R:
-        __write_props['created'] = False
-        __write_props['modified'] = False
-    else:
-        __write_props['created'] = (
-            irods_extra.value(opts, 'openType') == irods_extra.FILE_CREATE)
-
-        __write_props['modified'] = irods_extra.replica_truncated(flags)
-
+    irods_extra.record_open(__name__, data_obj_inp)
     return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2], outputs=[3])
-def pep_api_replica_open_post(_ctx, _instance, _, data_obj_inp):  # pyright: ignore
+def pep_api_replica_open_post(_ctx, _instance, _comm, data_obj_inp):  # pyright: ignore
     """Ensure data object editted by replica API has two up-to-date replicas.
 
     If a data object was created, replica its original replica. If a data
     object was modified, ensure the unmodified replica is updated. The work
     will be done in data_obj_write and replica_close. To pass the required
     information along to these rules, the following entries are added to the
-    global dict __write_props.
+    write properties.
 
     'data_path'  the absolute path to the data object
     'resc_hier'  the storage resource of the created or modified replica
     'created'    whether or not the data object was created
     'modified'   whether or not the data object has been modified
     """
-    flags = str(data_obj_inp.openFlags)
-    opts = data_obj_inp.condInput
-    __write_props['data_path'] = str(data_obj_inp.objPath)
-    __write_props['resc_hier'] = irods_extra.value(opts, 'resc_hier')
-
-    if flags == irods_extra.OPEN_FLAG_R:
-        __write_props['created'] = False
-        __write_props['modified'] = False
-    else:
-        __write_props['created'] = (
-            irods_extra.value(opts, 'openType') == irods_extra.FILE_CREATE)
-
-        __write_props['modified'] = irods_extra.replica_truncated(flags)
-
+    irods_extra.record_open(__name__, data_obj_inp)
     return irods_extra.SUCCESS
 
 
@@ -402,56 +661,31 @@ def pep_api_data_obj_write_post(
     _ctx, _instance, _comm, _data_obj_write_inp, _  # pyright: ignore
 ):
     """See data_obj_open and replica_opne for more details."""
-    __write_props['modified'] = True
+    irods_extra.write_props(__name__)['modified'] = True
+    return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2])
 def pep_api_data_obj_close_post(ctx, _instance, _comm, _):  # pyright: ignore
     """See data_obj_create and data_obj_open for more details."""
-    if __write_props['created']:
-        repl_resc = residency.get_repl_resc(
-            ctx, irods_extra.root_resc(__write_props['resc_hier']))
-
-        if repl_resc:
-            _sched_replication(
-                ctx,
-                _query_data_id(ctx, __write_props['data_path']),
-                repl_resc)
-    elif __write_props['modified']:
-        _sched_sync_replicas(
-            ctx, _query_data_id(ctx, __write_props['data_path']))
-
-    return irods_extra.SUCCESS
+    return _replicate_on_close(ctx)
 
 
 @rule.make(inputs=[0,1,2])
 def pep_api_data_obj_close_finally(_ctx, _instance, _comm, _):  # pyright: ignore
-    """Reset __write_props in case it's needed again in the current session."""
-    __write_props.clear()
+    """Reset the write properties in case they're needed again this session."""
+    irods_extra.reset_write_props(__name__)
     return irods_extra.SUCCESS
 
 
 @rule.make(inputs=[0,1,2])
-def pep_api_replica_close_post(ctx, _instance, _, json_input):  # pyright: ignore
+def pep_api_replica_close_post(ctx, _instance, _comm, _json_input):  # pyright: ignore
     """See replica_open for details."""
-    if __write_props['created']:
-        repl_resc = residency.get_repl_resc(
-            ctx, irods_extra.root_resc(__write_props['resc_hier']))
-
-        if repl_resc:
-            _sched_replication(
-                ctx,
-                _query_data_id(ctx, __write_props['data_path']),
-                repl_resc)
-    elif __write_props['modified']:
-        _sched_sync_replicas(
-            ctx, _query_data_id(ctx, __write_props['data_path']))
-
-    return irods_extra.SUCCESS
+    return _replicate_on_close(ctx)
 
 
 @rule.make(inputs=[0,1,2])
-def pep_api_replica_close_post(ctx, _instance, _comm, _):  # pyright: ignore
-    """Reset __write_props in case it's needed again in this session."""
-    __write_props.clear()
+def pep_api_replica_close_finally(_ctx, _instance, _comm, _):  # pyright: ignore
+    """Reset the write properties in case they're needed again this session."""
+    irods_extra.reset_write_props(__name__)
     return irods_extra.SUCCESS
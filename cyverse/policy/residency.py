@@ -22,6 +22,8 @@ to 'forced' means the resource choice cannot be overridden. Setting it to any
 other value means the choice can be overridden.
 """
 
+import time
+
 import genquery  # type: ignore
 import session_vars  # type: ignore
 
@@ -37,43 +39,82 @@ _REPL_RESC_ATTR = 'ipc::replica-resource'
 _RESIDENCY_FORCE = 'forced'
 _RESIDENCY_PREF = 'preferred'
 
+# GenQuery conditions selecting resource AVUs
+_HOST_COLL_COND = "META_RESC_ATTR_NAME = '%s'" % _HOST_COLL_ATTR
+_REPL_SCHEME_COND = (
+    "RESC_NAME = '%%s' and META_RESC_ATTR_NAME = '%s'" % _REPL_RESC_ATTR)
+
+
+# The hosted collection AVU records, with each collection path ending in a
+# slash and sorted longest first, and the time they were looked up
+__host_colls = None
+__host_colls_time = 0
+
+# the number of seconds the hosted collection AVUs are trusted
+_HOST_COLLS_TTL = 300
+
+
+def _query_host_colls(ctx):
+    global __host_colls, __host_colls_time
+
+    now = time.time()
+
+    if __host_colls is None or now - __host_colls_time > _HOST_COLLS_TTL:
+        cols = ('META_RESC_ATTR_VALUE', 'META_RESC_ATTR_UNITS', 'RESC_NAME')
+
+        # The trailing slash keeps a collection from matching the paths in a
+        # sibling collection whose name begins with the same characters.
+        __host_colls = sorted(
+            [
+                (coll.rstrip('/') + '/', units, resc)
+                for coll, units, resc in genquery.Query(
+                    ctx.callback, cols, _HOST_COLL_COND)],
+            key=lambda rec: len(rec[0]),
+            reverse=True)
+
+        __host_colls_time = now
+
+    return __host_colls
+
 
 def _query_create_scheme(ctx, data_path):
     resc = irods_extra.default_resc()
     residency = _RESIDENCY_PREF
 
-    cols = (
-        'ORDER_DESC(META_RESC_ATTR_VALUE)',
-        'META_RESC_ATTR_UNITS',
-        'RESC_NAME')
-
-    for rec in genquery.Query(
-        ctx.callback,
-        cols,
-        "META_RESC_ATTR_NAME = '{}'".format(_HOST_COLL_ATTR)
-    ):
-        if data_path.startswith(rec[0]):
-            residency = rec[1].lower()
-            resc = rec[2]
-
-            # Since the results are sorted lexicographically by hosted
-            # collection path in descending order, the first match is the most
-            # specific match. We can stop looking.
+    for host_coll, units, host_resc in _query_host_colls(ctx):
+        if data_path.startswith(host_coll):
+            residency = units.lower()
+            resc = host_resc
+
+            # Since the hosted collections are sorted longest first, the first
+            # match is the most specific match. We can stop looking.
             break
 
     return resc, residency
 
 
+# The replication schemes of the resources looked up recently, keyed by
+# resource name. Each entry is a pair of the scheme, or None if there isn't
+# one, and the time it was looked up.
+__repl_schemes = {}
+
+# the number of seconds a replication scheme lookup is trusted
+_REPL_SCHEME_TTL = 300
+
+
 def _query_repl_scheme(ctx, resc):
-    cond = "RESC_NAME = '{}' and META_RESC_ATTR_NAME = '{}'".format(
-        resc, _REPL_RESC_ATTR)
+    now = time.time()
+    entry = __repl_schemes.get(resc)
+
+    if entry is None or now - entry[1] > _REPL_SCHEME_TTL:
+        cond = _REPL_SCHEME_COND % resc
+        cols = ('META_RESC_ATTR_VALUE', 'META_RESC_ATTR_UNITS')
+        scheme = genquery.Query(ctx.callback, cols, cond).first()
 
-    for rec in genquery.Query(
-        ctx.callback, ('META_RESC_ATTR_VALUE', 'META_RESC_ATTR_UNITS'), cond
-    ):
-        return rec
+        entry = (scheme, now)
+        __repl_schemes[resc] = entry
 
-    return None
+    return entry[0]
 
 
 def _set_default_scheme(ctx, scheme):
@@ -115,7 +156,7 @@ def acSetRescSchemeForRepl(ctx):
     coll_path, data_name = irods_extra.split_path(data_path)
 
     cols = ('DATA_RESC_HIER', 'DATA_REPL_STATUS')
-    cond = "COLL_NAME = '{}'and DATA_NAME = '{}'".format(coll_path, data_name)
+    cond = irods_extra.DATA_COND % (coll_path, data_name)
 
     cur_rescs = [
         (irods_extra.root_resc(rec[0]), rec[1])
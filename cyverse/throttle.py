@@ -7,11 +7,14 @@ delay rule server.
 """
 
 
+"""the longest delay in seconds, after which the delays start over at 0"""
+MAX_DELAY = 600
+
 __delay_time = -1
 
 
 def next_delay():
     """Return the next delay time in seconds."""
     global __delay_time
-    __delay_time += 1
+    __delay_time = (__delay_time + 1) % MAX_DELAY
     return __delay_time
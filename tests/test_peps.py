@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the PEP composition in cyverse.peps.
+
+The iRODS Python rule engine only runs on Python 2, so these need to be run
+with it, e.g., `python2 -m unittest discover tests`.
+"""
+
+import os
+import sys
+import types
+import unittest
+
+
+# irods_errors, genquery, and session_vars are provided by the rule engine
+# itself, so stand-ins are installed before cyverse is imported.
+def _install_rule_engine_modules():
+    irods_errors = types.ModuleType('irods_errors')
+    irods_errors.CAT_NOT_ROWS_FOUND = -808000
+    irods_errors.CAT_UNKNOWN_FILE = -817000
+    irods_errors.RULE_ENGINE_CONTINUE = 5000000
+    irods_errors.SYS_INTERNAL_ERR = -154000
+    irods_errors.SYS_NOT_ALLOWED = -169000
+    irods_errors.SYS_RESC_DOES_NOT_EXIST = -78000
+    irods_errors.USER_CHKSUM_MISMATCH = -314000
+
+    genquery = types.ModuleType('genquery')
+    genquery.AS_LIST = 0
+    genquery.Query = None
+
+    session_vars = types.ModuleType('session_vars')
+    session_vars.get_map = None
+
+    for mod in (irods_errors, genquery, session_vars):
+        sys.modules.setdefault(mod.__name__, mod)
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+_install_rule_engine_modules()
+
+import irods_errors  # type: ignore  # noqa: E402
+
+from cyverse import peps  # noqa: E402
+from yoda import rule  # noqa: E402
+
+
+class _RuleBase(object):
+    """A rule base binding a rule.make rule to pep_api_data_obj_copy_post."""
+
+    def __init__(self):
+        self.seen = []
+
+        @rule.make(inputs=[0,1,2,3])
+        def pep_api_data_obj_copy_post(_ctx, instance, comm, inp, _):
+            self.seen.append((instance, comm, inp))
+            return 0
+
+        self.pep_api_data_obj_copy_post = pep_api_data_obj_copy_post
+
+
+class _FailingRuleBase(object):
+    """A rule base whose pep_api_data_obj_copy_post returns an error code.
+
+    A rule.make rule's wrapper always returns None, so this one follows the
+    plain iRODS calling convention instead.
+    """
+
+    def pep_api_data_obj_copy_post(self, _rule_args, _callback, _rei):
+        return -1
+
+
+def _compose(rule_bases, **kwargs):
+    @peps._compose(rule_bases, **kwargs)
+    def pep_api_data_obj_copy_post(): pass
+
+    return pep_api_data_obj_copy_post
+
+
+class ComposeTest(unittest.TestCase):
+
+    def test_each_rule_sees_the_rule_args(self):
+        bases = [_RuleBase(), _RuleBase()]
+        pep = _compose(bases)
+
+        res = pep(['instance', 'comm', 'input', 'output'], None, None)
+
+        self.assertEqual(res, irods_errors.RULE_ENGINE_CONTINUE)
+
+        for base in bases:
+            self.assertEqual(base.seen, [('instance', 'comm', 'input')])
+
+    def test_rules_leave_the_rule_args_alone(self):
+        rule_args = ['instance', 'comm', 'input', 'output']
+        _compose([_RuleBase(), _RuleBase()])(rule_args, None, None)
+        self.assertEqual(rule_args, ['instance', 'comm', 'input', 'output'])
+
+    def test_stops_at_first_failure(self):
+        last = _RuleBase()
+        pep = _compose([_FailingRuleBase(), last], fail_resp=None)
+        self.assertEqual(pep(['i', 'c', 'in', 'out'], None, None), -1)
+        self.assertEqual(last.seen, [])
+
+    def test_continues_on_failure(self):
+        last = _RuleBase()
+        pep = _compose(
+            [_FailingRuleBase(), last], fail_resp=None, cont_on_fail=True)
+        self.assertEqual(pep(['i', 'c', 'in', 'out'], None, None), -1)
+        self.assertEqual(last.seen, [('i', 'c', 'in')])
+
+
+if __name__ == '__main__':
+    unittest.main()